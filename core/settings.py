@@ -190,7 +190,7 @@ BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000").rstrip("/")
 CUSTOM_FIELD_NAME = os.environ.get("CUSTOM_FIELD_NAME", "Annotations")
 ENABLE_AUTO_UPDATE_LINKS = _is_true(os.environ.get("ENABLE_AUTO_UPDATE_LINKS", "true"))
 UPDATE_INTERVAL_MINS = int(os.environ.get("UPDATE_INTERVAL_MINS", "60"))
-ANNO_SERIALIZER = os.environ.get("ANNO_SERIALIZER", "85gj")
+ANNO_SERIALIZER = os.environ.get("ANNO_SERIALIZER", "85zj")
 ANNO_STORAGE = os.environ.get("ANNO_STORAGE", "paperless_notes").lower()
 
 with open(BASE_DIR / "pyproject.toml", "rb") as f:
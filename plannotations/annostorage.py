@@ -1,18 +1,58 @@
 import json
 import gzip
 import base64
+import functools
 import logging
+import re
+import threading
+import zlib
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import AsyncGenerator, Optional
 from datetime import datetime
+import orjson
+import pybase64
+import zstandard
 from django.template import Template, Context
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from core.settings import ANNO_SERIALIZER, ANNO_STORAGE
 from .models import DbAnnotation
-from .paperless_api import PaperlessAPI
+from .paperless_api import Document, Note, PaperlessAPI
 
 logger = logging.getLogger(__name__)
 
+_collapse_blank_lines = re.compile(r"\n{2,}").sub
+
+
+@functools.lru_cache(maxsize=1)
+def _get_note_template() -> Template:
+    """Read and compile the note header template once per process."""
+    with open("note_annotation.template", "r", encoding="utf-8") as template_file:
+        return Template(template_file.read())
+
+
+# template variables whose rendered value can't contain a line break
+_SINGLE_LINE_TEMPLATE_VARS = {"page", "page_index", "created", "type"}
+
+
+@functools.lru_cache(maxsize=1)
+def _template_has_page_line() -> bool:
+    """Check whether the note header's first `Page: N` line is the page.
+
+    True if the template renders the page on its own line and only single-line
+    variables come before it. Otherwise user content such as a comment could
+    contain a `Page: N` line that would be found first.
+    """
+    source = _get_note_template().source
+    page_line = re.search(r"^Page: {{ ?page ?}}$", source, re.MULTILINE)
+    if page_line is None:
+        return False
+    preceding = source[: page_line.start()]
+    if "{%" in preceding:
+        return False
+    variables = re.findall(r"{{\s*(\w+)", preceding)
+    return all(var in _SINGLE_LINE_TEMPLATE_VARS for var in variables)
+
 
 class Annotation(BaseModel):
     created: str
@@ -26,9 +66,15 @@ class Annotation(BaseModel):
         extra = "allow"
 
 
+_annotation_list_adapter = TypeAdapter(list[Annotation])
+
+
 class AnnoStorage(ABC):
     """Abstract base class for annotation storage backends."""
 
+    # Document fields get_annotated_doc_ids needs from the document list
+    DOCUMENT_FIELDS: tuple[str, ...] = ("id",)
+
     @abstractmethod
     def get_annotations(
         self, doc_id: int, page: Optional[int] = None
@@ -49,10 +95,35 @@ class AnnoStorage(ABC):
     def delete_annotation_by_id(self, doc_id: int, db_id: int) -> bool:
         """Delete an annotation by its database ID."""
 
+    def delete_annotations_by_ids(self, doc_id: int, db_ids: list[int]) -> bool:
+        """Delete several annotations of a document at once.
+
+        Returns True if all annotations were deleted.
+        """
+        deleted = [self.delete_annotation_by_id(doc_id, db_id) for db_id in db_ids]
+        return all(deleted)
+
+    def get_annotated_doc_ids(self, documents: list[Document]) -> set[int]:
+        """Return the ids of all given documents that have annotations."""
+        return {
+            doc.id
+            for doc in documents
+            if next(iter(self.get_annotations(doc.id)), None) is not None
+        }
+
 
 class AnnoSerializer(ABC):
     """Abstract base class for data serialization strategies."""
 
+    NAME: str
+    # True if the output can't contain the note delimiters (e.g. no spaces)
+    DELIMITER_SAFE = False
+    _registry: dict[str, type["AnnoSerializer"]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        AnnoSerializer._registry[cls.NAME] = cls
+
     @staticmethod
     @abstractmethod
     def serialize(obj):
@@ -66,17 +137,18 @@ class AnnoSerializer(ABC):
     @classmethod
     def get_serializer_by_name(cls, name: str) -> "AnnoSerializer":
         """Get a serializer class by its name."""
-        for subclass in cls.__subclasses__():
-            if subclass.NAME == name:
-                return subclass
-        raise ValueError(
-            f"Serializer with name '{name}' not found. Known serializers: "
-            + ", ".join([sc.NAME for sc in cls.__subclasses__()])
-        )
+        try:
+            return cls._registry[name]
+        except KeyError:
+            raise ValueError(
+                f"Serializer with name '{name}' not found. Known serializers: "
+                + ", ".join(cls._registry)
+            ) from None
 
 
 class Base85GzipJSONSerializer(AnnoSerializer):
     NAME = "85gj"
+    DELIMITER_SAFE = True
 
     @staticmethod
     def serialize(obj):
@@ -86,7 +158,87 @@ class Base85GzipJSONSerializer(AnnoSerializer):
     @staticmethod
     def deserialize(s):
         """Deserialize a base85-encoded gzip-compressed JSON string to an object."""
-        return json.loads(gzip.decompress(base64.b85decode(s.encode())).decode())
+        return json.loads(gzip.decompress(base64.b85decode(s)))
+
+
+class Base85ZlibJSONSerializer(AnnoSerializer):
+    """Base85-encoded JSON, zlib-compressed unless the JSON is small.
+
+    The first byte of the encoded data flags the format: b"0" raw JSON,
+    b"1" zlib-compressed JSON.
+    """
+
+    NAME = "85zj"
+    DELIMITER_SAFE = True
+    COMPRESS_MIN_SIZE = 512
+
+    @staticmethod
+    def serialize(obj):
+        """Serialize an object to a base85-encoded, optionally compressed JSON string."""
+        raw = json.dumps(obj).encode()
+        if len(raw) < Base85ZlibJSONSerializer.COMPRESS_MIN_SIZE:
+            data = b"0" + raw
+        else:
+            data = b"1" + zlib.compress(raw, 1)
+        return base64.b85encode(data).decode()
+
+    @staticmethod
+    def deserialize(s):
+        """Deserialize a base85-encoded, optionally compressed JSON string to an object."""
+        data = base64.b85decode(s)
+        if data.startswith(b"1"):
+            raw = zlib.decompress(data[1:])
+        else:
+            raw = data[1:]
+        return json.loads(raw)
+
+
+class PyBase64GzipJsonSerializer(AnnoSerializer):
+    NAME = "pbgj"
+    DELIMITER_SAFE = True
+
+    @staticmethod
+    def serialize(obj):
+        """Serialize an object to a base64-encoded gzip-compressed JSON string."""
+        return pybase64.b64encode_as_string(gzip.compress(json.dumps(obj).encode()))
+
+    @staticmethod
+    def deserialize(s):
+        """Deserialize a base64-encoded gzip-compressed JSON string to an object."""
+        return json.loads(gzip.decompress(pybase64.b64decode(s)))
+
+
+# zstd contexts are not thread-safe, keep one pair per thread and reuse it
+_zstd_contexts = threading.local()
+
+
+def _zstd_compressor() -> zstandard.ZstdCompressor:
+    if not hasattr(_zstd_contexts, "compressor"):
+        _zstd_contexts.compressor = zstandard.ZstdCompressor(level=3)
+    return _zstd_contexts.compressor
+
+
+def _zstd_decompressor() -> zstandard.ZstdDecompressor:
+    if not hasattr(_zstd_contexts, "decompressor"):
+        _zstd_contexts.decompressor = zstandard.ZstdDecompressor()
+    return _zstd_contexts.decompressor
+
+
+class OrjsonZstdB64Serializer(AnnoSerializer):
+    NAME = "ozb"
+    DELIMITER_SAFE = True
+
+    @staticmethod
+    def serialize(obj):
+        """Serialize an object to a base64-encoded zstd-compressed JSON string."""
+        return base64.b64encode(_zstd_compressor().compress(orjson.dumps(obj))).decode(
+            "ascii"
+        )
+
+    @staticmethod
+    def deserialize(s):
+        """Deserialize a base64-encoded zstd-compressed JSON string to an object."""
+        return orjson.loads(_zstd_decompressor().decompress(base64.b64decode(s)))
 
 
 class JsonSerializer(AnnoSerializer):
@@ -103,32 +255,120 @@ class JsonSerializer(AnnoSerializer):
         return json.loads(s)
 
 
+class OrjsonSerializer(AnnoSerializer):
+    NAME = "oj"
+
+    @staticmethod
+    def serialize(obj):
+        """Serialize an object to a JSON string."""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+    @staticmethod
+    def deserialize(s):
+        """Deserialize a JSON string to an object."""
+        return orjson.loads(s)
+
+
+@functools.lru_cache(maxsize=1)
+def _default_anno_serializer() -> AnnoSerializer:
+    """Look up the configured serializer once, only when notes storage is used."""
+    return AnnoSerializer.get_serializer_by_name(ANNO_SERIALIZER)
+
+
 class PaperlessNotesStorage(AnnoStorage):
     """Annotation storage implementation using Paperless-ngx document notes."""
 
+    DOCUMENT_FIELDS = ("id", "notes")
     ANNOTATION_CONTENT_BEGIN = "------------ DATA BEGIN ------------"
     ANNOTATION_CONTENT_END = "------------ DATA END ------------"
+    _DELIMITER_PREFIX = "------------ DATA "
+    _PAGE_LINE_RE = re.compile(r"^Page: (\d+)$", re.MULTILINE)
+    # serializer name on the first line after BEGIN, payload up to END
+    _DATA_AREA_RE = re.compile(
+        re.escape(ANNOTATION_CONTENT_BEGIN)
+        + r"\s*(\S+)[^\S\n]*\n(.*?)\s*"
+        + re.escape(ANNOTATION_CONTENT_END),
+        re.DOTALL,
+    )
 
     def __init__(self, paperless: PaperlessAPI):
-        self.default_anno_serializer = AnnoSerializer.get_serializer_by_name(
-            ANNO_SERIALIZER
-        )
+        self.default_anno_serializer = _default_anno_serializer()
         self.paperless = paperless
-
-    def get_annotations(self, doc_id: int, page: Optional[int] = None):
-        """Retrieve annotations from document notes, optionally filtered by page."""
-        notes = self.paperless.document_notes(doc_id)
+        # doc id -> notes, dropped whenever a note of the document changes
+        self._notes_cache: dict[int, list[Note]] = {}
+        # note id -> parsed annotation, notes are never edited so no invalidation
+        self._anno_cache: dict[int, Optional[Annotation]] = {}
+
+    def _document_notes(self, doc_id: int) -> list[Note]:
+        """Return the notes of a document, fetching them at most once."""
+        notes = self._notes_cache.get(doc_id)
+        if notes is None:
+            notes = self.paperless.document_notes(doc_id)
+            self._notes_cache[doc_id] = notes
+        return notes
+
+    def _parse_notes(self, notes: list[Note]):
+        """Parse notes to annotations and store them in the annotation cache."""
+        payloads = {}
         for note in notes:
             try:
-                annotation = self._note_content_to_anno(note.note)
-                annotation.db_id = note.id
-                if page is None or annotation.pageIndex == page:
-                    yield annotation
+                payload = self._note_content_to_payload(note.note)
             except Exception:
                 # Skip malformed notes that can't be parsed as annotations
+                payload = None
+            if isinstance(payload, dict):
+                payloads[note.id] = {**payload, "db_id": note.id}
+            else:
+                self._anno_cache[note.id] = None
+        if not payloads:
+            return
+        try:
+            annotations = _annotation_list_adapter.validate_python(
+                list(payloads.values())
+            )
+        except ValidationError:
+            # One invalid payload fails the whole batch, validate one by one
+            annotations = []
+            for payload in payloads.values():
+                try:
+                    annotations.append(Annotation.model_validate(payload))
+                except ValidationError:
+                    annotations.append(None)
+        self._anno_cache.update(zip(payloads, annotations))
+
+    def _peek_page_index(self, note_content: str) -> Optional[int]:
+        """Read the page index from a note header without decoding the data.
+
+        Returns None if the header doesn't show the page.
+        """
+        if not _template_has_page_line():
+            return None
+        header_end = note_content.find(self.ANNOTATION_CONTENT_BEGIN)
+        if header_end == -1:
+            return None
+        match = self._PAGE_LINE_RE.search(note_content, 0, header_end)
+        return int(match.group(1)) - 1 if match else None
+
+    def get_annotations(self, doc_id: int, page: Optional[int] = None):
+        """Retrieve annotations from document notes, optionally filtered by page."""
+        notes = self._document_notes(doc_id)
+        if page is not None:
+            # Skip decoding notes whose header already shows another page
+            notes = [
+                note
+                for note in notes
+                if note.id in self._anno_cache
+                or self._peek_page_index(note.note) in (None, page)
+            ]
+        self._parse_notes([note for note in notes if note.id not in self._anno_cache])
+        for note in notes:
+            annotation = self._anno_cache[note.id]
+            if annotation is None:
                 continue
+            if page is None or annotation.pageIndex == page:
+                yield annotation
 
-    def _build_note_header(self, annotation: Annotation) -> str:
+    def _build_note_header(self, annotation: Annotation, dumped: dict) -> str:
         """Build the header part of a note for an annotation."""
 
         created_formatted = annotation.created
@@ -144,34 +384,35 @@ class PaperlessNotesStorage(AnnoStorage):
             "page_index": annotation.pageIndex,
             "created": created_formatted,
             "comment": annotation.contents or "",
-            "text": getattr(annotation, "custom", {}).get("text", None),
+            "text": (dumped.get("custom") or {}).get("text", None),
             "type": annotation.type,
             "annotation": annotation,
         }
-        with open("note_annotation.template", "r", encoding="utf-8") as template_file:
-            template_content = template_file.read()
-            template = Template(template_content)
-            rendered_header = template.render(Context(context)).replace("\n\n", "\n")
-            return rendered_header
+        rendered_header = _get_note_template().render(Context(context))
+        return _collapse_blank_lines("\n", rendered_header)
+
+    def _contains_delimiter(self, text: str) -> bool:
+        """Check whether text contains one of the data area delimiters."""
+        # Both delimiters share a prefix, a miss on it settles it in one scan
+        return self._DELIMITER_PREFIX in text and (
+            self.ANNOTATION_CONTENT_BEGIN in text
+            or self.ANNOTATION_CONTENT_END in text
+        )
 
     def _anno_to_note_content(self, annotation: Annotation) -> str:
         """Serialize an annotation for storage in a Paperless note."""
 
-        serialized = (
-            self.default_anno_serializer.serialize(annotation.model_dump()) + "\n"
-        )
-        header = self._build_note_header(annotation)
-        if (
-            self.ANNOTATION_CONTENT_BEGIN in header
-            or self.ANNOTATION_CONTENT_END in header
-        ):
+        dumped = annotation.model_dump()
+        serialized = self.default_anno_serializer.serialize(dumped) + "\n"
+        header = self._build_note_header(annotation, dumped)
+        if self._contains_delimiter(header):
             raise ValueError(
                 "Annotation header contains reserved content delimiter "
                 + f"{self.ANNOTATION_CONTENT_BEGIN} or {self.ANNOTATION_CONTENT_END}"
             )
         if (
-            self.ANNOTATION_CONTENT_BEGIN in serialized
-            or self.ANNOTATION_CONTENT_END in serialized
+            not self.default_anno_serializer.DELIMITER_SAFE
+            and self._contains_delimiter(serialized)
         ):
             raise ValueError(
                 "Serialized annotation contains reserved content delimiter "
@@ -185,28 +426,18 @@ class PaperlessNotesStorage(AnnoStorage):
         content += f"{self.ANNOTATION_CONTENT_END}"
         return content
 
-    def _note_content_to_anno(self, note_content: str) -> Annotation:
-        """Deserialize a Paperless note's JSON content to an annotation."""
-        begin_idx = note_content.find(self.ANNOTATION_CONTENT_BEGIN)
-        end_idx = note_content.find(self.ANNOTATION_CONTENT_END)
-        if begin_idx == -1 or end_idx == -1:
-            return None
-        data_area = note_content[
-            begin_idx + len(self.ANNOTATION_CONTENT_BEGIN) : end_idx
-        ].strip()
-
-        serializer_name = data_area.splitlines()[0].strip()
-        if not serializer_name:
+    def _note_content_to_payload(self, note_content: str) -> Optional[dict]:
+        """Deserialize the data area of a Paperless note to an annotation dict."""
+        match = self._DATA_AREA_RE.search(note_content)
+        if match is None:
             return None
+        serializer_name, data_area = match.groups()
         serializer = AnnoSerializer.get_serializer_by_name(serializer_name)
-        data_area = "\n".join(data_area.splitlines()[1:])
-        note_content = serializer.deserialize(data_area)
-        if note_content is None:
-            return None
-        return Annotation(**note_content)
+        return serializer.deserialize(data_area)
 
     def create_annotation(self, doc_id: int, annotation: Annotation) -> Annotation:
         """Create a new annotation as a document note."""
+        self._notes_cache.pop(doc_id, None)
         note = self.paperless.add_note_to_document(
             doc_id=doc_id, note=self._anno_to_note_content(annotation)
         )
@@ -216,26 +447,54 @@ class PaperlessNotesStorage(AnnoStorage):
     def update_annotation(
         self, doc_id: int, updated_annotation: Annotation
     ) -> Annotation:
-        """Update an annotation by replacing its note content."""
+        """Update an annotation by replacing its note content.
+
+        Paperless-ngx can't edit notes, so the old note is deleted while the
+        new one is created.
+        """
         old_note_id = updated_annotation.db_id
         if old_note_id is None:
             raise ValueError("Cannot update annotation without db_id")
+        new_content = self._anno_to_note_content(updated_annotation)
+        self._notes_cache.pop(doc_id, None)
 
-        # Delete old note
-        if not self.delete_annotation_by_id(doc_id, old_note_id):
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            delete_future = executor.submit(
+                self.delete_annotation_by_id, doc_id, old_note_id
+            )
+            note = self.paperless.add_note_to_document(doc_id=doc_id, note=new_content)
+            try:
+                deleted = delete_future.result()
+            except Exception:
+                # Don't leave a duplicate behind if the old note is still there
+                self.paperless.delete_note(doc_id, note.id)
+                raise
+        if not deleted:
+            self.paperless.delete_note(doc_id, note.id)
             raise ValueError(f"Annotation with db_id {old_note_id} not found")
 
-        # Create new note with updated content
-        note = self.paperless.add_note_to_document(
-            doc_id=doc_id, note=self._anno_to_note_content(updated_annotation)
-        )
         updated_annotation.db_id = note.id
         return updated_annotation
 
     def delete_annotation_by_id(self, doc_id: int, db_id: int) -> bool:
         """Delete an annotation by finding and removing its corresponding note."""
+        self._notes_cache.pop(doc_id, None)
         return self.paperless.delete_note(doc_id, db_id)
 
+    def delete_annotations_by_ids(self, doc_id: int, db_ids: list[int]) -> bool:
+        """Delete several annotations by removing their corresponding notes."""
+        self._notes_cache.pop(doc_id, None)
+        return self.paperless.delete_notes(doc_id, db_ids)
+
+    def get_annotated_doc_ids(self, documents: list[Document]) -> set[int]:
+        """Return the ids of all given documents that have annotations."""
+        # Paperless-ngx embeds the notes in document responses, reuse them
+        # instead of fetching each document's notes again
+        for doc in documents:
+            if "notes" in doc.model_fields_set:
+                self._notes_cache[doc.id] = doc.notes
+        return super().get_annotated_doc_ids(documents)
+
 
 class DatabaseAnnotationStorage(AnnoStorage):
     def create_annotation(self, doc_id, annotation):
@@ -253,15 +512,14 @@ class DatabaseAnnotationStorage(AnnoStorage):
     def get_annotations(self, doc_id: int, page: Optional[int] = None):
         """Retrieve annotations from the database, optionally filtered by page."""
         query = None
-        if page:
+        if page is not None:
             query = DbAnnotation.objects.filter(doc_id=doc_id, page_index=page)
         else:
             query = DbAnnotation.objects.filter(doc_id=doc_id)
-        for db_anno in query:
+        for db_anno in query.only("id", "anno_obj").iterator(chunk_size=500):
             anno = Annotation(**db_anno.anno_obj)
             anno.db_id = db_anno.id
-            if page is None or anno.pageIndex == page:
-                yield anno
+            yield anno
 
     def update_annotation(self, doc_id: int, updated_annotation: Annotation):
         """Update an existing annotation in the database."""
@@ -280,6 +538,27 @@ class DatabaseAnnotationStorage(AnnoStorage):
         except DbAnnotation.DoesNotExist:
             return False
 
+    def delete_annotations_by_ids(self, doc_id: int, db_ids: list[int]) -> bool:
+        """Delete several annotations with a single query."""
+        unique_ids = set(db_ids)
+        deleted, _ = DbAnnotation.objects.filter(
+            doc_id=doc_id, id__in=unique_ids
+        ).delete()
+        return deleted == len(unique_ids)
+
+    def get_annotated_doc_ids(self, documents: list[Document]) -> set[int]:
+        """Return the ids of all given documents that have annotations."""
+        # One query for all annotated documents, intersecting in Python avoids
+        # hitting the SQL parameter limit with a huge `doc_id__in` list.
+        annotated = set(
+            DbAnnotation.objects.values_list("doc_id", flat=True).distinct()
+        )
+        return {doc.id for doc in documents if doc.id in annotated}
+
+
+# The database storage holds no state, so one instance serves every request
+_database_storage = DatabaseAnnotationStorage()
+
 
 def get_configured_annotation_storage(
     paperless: PaperlessAPI,
@@ -287,7 +566,7 @@ def get_configured_annotation_storage(
     """Get the annotation storage backend as per configuration."""
     if ANNO_STORAGE == "database":
         logger.info("Using DatabaseAnnotationStorage for annotations")
-        return DatabaseAnnotationStorage()
+        return _database_storage
     elif ANNO_STORAGE == "paperless_notes":
         logger.info("Using PaperlessNotesStorage for annotations")
         return PaperlessNotesStorage(paperless)
@@ -1,5 +1,7 @@
-from typing import Any, Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Iterator, Optional
 import logging
+from django.db import connections
 from .paperless_api import PaperlessAPI
 from .annostorage import Annotation, get_configured_annotation_storage
 
@@ -17,6 +19,11 @@ class PaperlessAnnotator:
         logger.debug("Downloading document %d", doc_id)
         return self.paperless.download_document(doc_id)
 
+    def download_document_stream(self, doc_id: int) -> Iterator[bytes]:
+        """Return the raw PDF for a Paperless document as an iterator of chunks."""
+        logger.debug("Streaming document %d", doc_id)
+        return self.paperless.download_document_stream(doc_id)
+
     def get_page_annotations(self, doc_id: int, page: Optional[int]) -> Iterable[Any]:
         """List annotations for a document.
         If `page` is provided, only return annotations for that page.
@@ -28,22 +35,19 @@ class PaperlessAnnotator:
     def delete_anno(self, doc_id: int, annotation: Annotation) -> bool:
         """Delete an annotation and all its replies."""
         logger.info("Deleting annotation %s from doc %d", annotation.db_id, doc_id)
-        # Delete all reply annotations first
-        for other_anno in self.annotation_storage.get_annotations(
-            doc_id, annotation.pageIndex
-        ):
-            is_reply = (
-                other_anno.db_id != annotation.db_id
-                and getattr(other_anno, "inReplyToId", None) == annotation.id
+        # Delete the annotation together with all its replies
+        reply_ids = [
+            other_anno.db_id
+            for other_anno in self.annotation_storage.get_annotations(
+                doc_id, annotation.pageIndex
             )
-            if is_reply:
-                logger.debug("Deleting reply annotation %s", other_anno.db_id)
-                self.annotation_storage.delete_annotation_by_id(
-                    doc_id, other_anno.db_id
-                )
-
-        # Delete the main annotation
-        return self.annotation_storage.delete_annotation_by_id(doc_id, annotation.db_id)
+            if other_anno.db_id != annotation.db_id
+            and getattr(other_anno, "inReplyToId", None) == annotation.id
+        ]
+        logger.debug("Deleting reply annotations %s", reply_ids)
+        return self.annotation_storage.delete_annotations_by_ids(
+            doc_id, reply_ids + [annotation.db_id]
+        )
 
     def create_annotation(self, doc_id: int, annotation: Annotation) -> Annotation:
         """Create a new annotation for a document."""
@@ -62,30 +66,44 @@ class PaperlessAnnotator:
     def get_all_documents_with_annotations(self, docs_to_skip) -> Iterable[Any]:
         """Get all document IDs that have annotations."""
         logger.info("Getting all documents with annotations")
-        documents = list(self.paperless.documents_iter())
-        for doc in documents:
-
+        documents = []
+        fields = self.annotation_storage.DOCUMENT_FIELDS
+        for doc in self.paperless.documents_iter(fields=fields):
             if docs_to_skip and doc.id in docs_to_skip:
                 logger.debug("Skipping doc %d", doc.id)
                 continue
-            for _ in self.annotation_storage.get_annotations(doc.id):
+            documents.append(doc)
+        annotated_doc_ids = self.annotation_storage.get_annotated_doc_ids(documents)
+        for doc in documents:
+            if doc.id in annotated_doc_ids:
                 yield doc
-                break
+
+    def _delete_document_annotations(self, doc) -> bool:
+        """Delete all annotations of one document, return whether it had any."""
+        try:
+            db_ids = [
+                anno.db_id for anno in self.annotation_storage.get_annotations(doc.id)
+            ]
+            if db_ids:
+                self.annotation_storage.delete_annotations_by_ids(doc.id, db_ids)
+            return bool(db_ids)
+        finally:
+            # runs in a worker thread, don't leak its database connection
+            connections.close_all()
 
     def delete_all_annotations(self, docs_to_skip: None):
         """Delete all annotations for all documents, except those in docs_to_skip."""
         if docs_to_skip is None:
             docs_to_skip = []
         logger.info("Starting deletion of all annotations")
-        processed_docs = set()
-        documents = list(self.paperless.documents_iter())
-        logger.info("Found %d documents", len(documents))
-        for doc in self.get_all_documents_with_annotations(docs_to_skip=docs_to_skip):
-            if doc.id in docs_to_skip:
-                logger.debug("Skipping doc %d", doc.id)
-                continue
-            for anno in self.annotation_storage.get_annotations(doc.id):
-                self.annotation_storage.delete_annotation_by_id(doc.id, anno.db_id)
-                processed_docs.add(doc.id)
+        documents = list(
+            self.get_all_documents_with_annotations(docs_to_skip=docs_to_skip)
+        )
+        logger.info("Found %d documents with annotations", len(documents))
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            had_annotations = executor.map(self._delete_document_annotations, documents)
+            processed_docs = {
+                doc.id for doc, deleted in zip(documents, had_annotations) if deleted
+            }
         logger.info("Deleted annotations from %d documents", len(processed_docs))
         return processed_docs
@@ -1,6 +1,6 @@
 from typing import Any, Optional
 
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.dispatch import Signal
 from ninja import NinjaAPI
 from ninja.security import django_auth
@@ -9,7 +9,7 @@ from core.settings import PAPERLESS_URL
 from plannotations.tasks import task_auto_update_links
 from .annotations import PaperlessAnnotator
 from .annostorage import Annotation
-from .paperless_api import PaperlessAPI
+from .paperless_api import PaperlessAPI, get_paperless_api
 
 sig_user_added_annotation = Signal()
 
@@ -25,16 +25,16 @@ def get_paperless_instance(request) -> PaperlessAPI:
     if not request.user.is_authenticated:
         raise UserNotAuthenticated("User must be logged in to access Paperless.")
     token = request.user.paperless_api_token
-    return PaperlessAPI(PAPERLESS_URL, token)
+    return get_paperless_api(PAPERLESS_URL, token)
 
 
 @api.get("/documents/{doc_id}/download")
 def download_document(request, doc_id: int):
     """Download the raw PDF for a Paperless document."""
     ppl = get_paperless_instance(request)
-    pdf = PaperlessAnnotator(ppl).download_document(doc_id)
+    pdf = PaperlessAnnotator(ppl).download_document_stream(doc_id)
 
-    response = HttpResponse(pdf, content_type="application/pdf")
+    response = StreamingHttpResponse(pdf, content_type="application/pdf")
     response["Content-Disposition"] = f'attachment; filename="document_{doc_id}.pdf"'
     return response
 
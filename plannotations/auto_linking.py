@@ -1,3 +1,4 @@
+import functools
 import logging
 import time
 from django.urls import reverse
@@ -7,23 +8,27 @@ from core.settings import (
     PAPERLESS_URL,
     UPDATE_INTERVAL_MINS,
 )
-from .paperless_api import PaperlessAPI
+from .paperless_api import PaperlessAPI, get_paperless_api
 from .models import User
 
 logger = logging.getLogger(__name__)
 
 _custom_field_cache = {}
 
+# document fields needed to update links, skips e.g. the large `content`
+_LINK_UPDATE_FIELDS = ("id", "custom_fields")
+
 
 def delete_all_document_links(ppl: PaperlessAPI):
     """Delete all custom field links from all documents."""
     cf_query = [CUSTOM_FIELD_NAME, "exists", True]
-    removed_links = 0
     cf_id = _get_or_create_custom_link_field(ppl)
-    for doc in ppl.documents_custom_field_query_iter(cf_query):
-        ppl.delete_custom_field_from_document(doc, cf_id.id)
-        removed_links += 1
-    return removed_links
+    doc_ids = [
+        doc.id
+        for doc in ppl.documents_custom_field_query_iter(cf_query, fields=("id",))
+    ]
+    ppl.bulk_delete_custom_field(cf_id.id, doc_ids)
+    return len(doc_ids)
 
 
 def _get_or_create_custom_link_field(ppl: PaperlessAPI):
@@ -45,47 +50,52 @@ def _get_or_create_custom_link_field(ppl: PaperlessAPI):
     return cf
 
 
+@functools.lru_cache(maxsize=1)
+def _view_url_prefix() -> str:
+    """Return the document view URL without the document id."""
+    view_path = reverse("view_document", kwargs={"doc_id": 0})
+    return BASE_URL + view_path.rsplit("/", 1)[0] + "/"
+
+
 def update_document_links(ppl: PaperlessAPI, docs_to_skip: list[int] | None = None):
     if not docs_to_skip:
         docs_to_skip = []
 
+    prefix = _view_url_prefix()
     link_is_outdated_query = [
         "NOT",
         [
             CUSTOM_FIELD_NAME,
             "istartswith",
-            f"{BASE_URL}/view/",
+            prefix,
         ],
-    ]  # placeholder
+    ]
     link_not_exists_query = [
         CUSTOM_FIELD_NAME,
         "exists",
         False,
     ]
     custom_field = _get_or_create_custom_link_field(ppl)
-    updated_docs = []
-    for doc in ppl.documents_custom_field_query_iter(link_not_exists_query):
+    # doc id -> (doc, link); documents without the field match both queries
+    updates = {}
+    for doc in ppl.documents_custom_field_query_iter(
+        link_not_exists_query, fields=_LINK_UPDATE_FIELDS
+    ):
         if doc.id in docs_to_skip:
             continue
         logger.info("Adding missing link for doc %d", doc.id)
-        ppl.add_custom_field_to_document(
-            doc,
-            custom_field.id,
-            BASE_URL + reverse("view_document", kwargs={"doc_id": doc.id}),
-        )
-        updated_docs.append(doc.id)
-
-    for doc in ppl.documents_custom_field_query_iter(link_is_outdated_query):
-        if doc.id in docs_to_skip:
+        updates[doc.id] = (doc, f"{prefix}{doc.id}")
+
+    for doc in ppl.documents_custom_field_query_iter(
+        link_is_outdated_query, fields=_LINK_UPDATE_FIELDS
+    ):
+        if doc.id in docs_to_skip or doc.id in updates:
             continue
         logger.info("Updating outdated link for doc %d", doc.id)
-        ppl.add_custom_field_to_document(
-            doc,
-            custom_field.id,
-            BASE_URL + "/" + reverse("view_document", kwargs={"doc_id": doc.id}),
-        )
-        updated_docs.append(doc.id)
-    return updated_docs
+        updates[doc.id] = (doc, f"{prefix}{doc.id}")
+
+    ppl.bulk_set_custom_field(custom_field.id, list(updates.values()))
+    return list(updates)
 
 
 def auto_update_links_loop():
@@ -97,7 +107,7 @@ def auto_update_links_loop():
             updated_docs = []
             logger.info("Auto-linking: Starting link update scan")
             for user in User.objects.exclude(paperless_api_token=""):
-                ppl = PaperlessAPI(PAPERLESS_URL, user.paperless_api_token)
+                ppl = get_paperless_api(PAPERLESS_URL, user.paperless_api_token)
                 updated_docs += update_document_links(ppl, docs_to_skip=updated_docs)
             logger.info("Auto-linking: Link update scan completed")
         except Exception as e:
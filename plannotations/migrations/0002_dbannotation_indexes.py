@@ -0,0 +1,25 @@
+# Generated by Django 6.0.9 on 2026-10-15 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plannotations", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="dbannotation",
+            index=models.Index(
+                fields=["doc_id", "page_index"], name="plannotatio_doc_id_0b463a_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="dbannotation",
+            index=models.Index(
+                fields=["doc_id", "id"], name="plannotatio_doc_id_03f966_idx"
+            ),
+        ),
+    ]
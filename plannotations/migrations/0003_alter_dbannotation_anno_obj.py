@@ -0,0 +1,22 @@
+# Generated by Django 6.0.9 on 2026-10-15 21:12
+
+import plannotations.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("plannotations", "0002_dbannotation_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="dbannotation",
+            name="anno_obj",
+            field=models.JSONField(
+                decoder=plannotations.models.OrjsonDecoder,
+                encoder=plannotations.models.OrjsonEncoder,
+            ),
+        ),
+    ]
@@ -1,7 +1,23 @@
+import json
+import orjson
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
+class OrjsonEncoder(json.JSONEncoder):
+    """JSONField encoder that delegates to orjson."""
+
+    def encode(self, o):
+        return orjson.dumps(o).decode()
+
+
+class OrjsonDecoder(json.JSONDecoder):
+    """JSONField decoder that delegates to orjson."""
+
+    def decode(self, s, _w=None):
+        return orjson.loads(s)
+
+
 class User(AbstractUser):
     first_name = None
     last_name = None
@@ -16,4 +32,10 @@ class DbAnnotation(models.Model):
     doc_id = models.IntegerField()
     db_id = models.IntegerField()
     page_index = models.IntegerField(null=True)
-    anno_obj = models.JSONField()
+    anno_obj = models.JSONField(encoder=OrjsonEncoder, decoder=OrjsonDecoder)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["doc_id", "page_index"]),
+            models.Index(fields=["doc_id", "id"]),
+        ]
@@ -1,9 +1,18 @@
+import functools
 import logging
-import json
+import math
+import operator
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import date, datetime
-from typing import Any, Dict, List, Optional, Generator
+from typing import Any, Callable, Dict, List, Optional, Generator, Iterator, Tuple
+import orjson
 import requests
-from pydantic import BaseModel, Field
+from cachetools import TTLCache, cachedmethod, keys
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +25,8 @@ class BasicUser(BaseModel):
 
 
 class Note(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     note: str
     created: datetime
@@ -28,6 +39,8 @@ class CustomFieldInstance(BaseModel):
 
 
 class CustomField(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: int
     name: str
     data_type: str
@@ -36,6 +49,9 @@ class CustomField(BaseModel):
 
 
 class Document(BaseModel):
+    # instances are shared through PaperlessAPI's document cache
+    model_config = ConfigDict(frozen=True)
+
     id: int
     correspondent: Optional[int] = None
     document_type: Optional[int] = None
@@ -44,8 +60,9 @@ class Document(BaseModel):
     content: Optional[str] = None
     tags: List[int] = Field(default_factory=list)
     created: Optional[date] = None
-    modified: datetime
-    added: datetime
+    # optional so that documents requested with a subset of `fields` validate
+    modified: Optional[datetime] = None
+    added: Optional[datetime] = None
     deleted_at: Optional[datetime] = None
     archive_serial_number: Optional[int] = None
     original_file_name: Optional[str] = None
@@ -76,25 +93,104 @@ class PaginatedCustomFieldList(BaseModel):
     all: Optional[List[int]] = None
 
 
+_document_list_adapter = TypeAdapter(List[Document])
+_note_list_adapter = TypeAdapter(List[Note])
+_custom_field_list_adapter = TypeAdapter(List[CustomField])
+
+
+class _ResponseChunks:
+    """Iterable over the body of a streamed response that releases it on close.
+
+    A plain generator doesn't run its cleanup when closed before the first
+    iteration, e.g. when Django closes a StreamingHttpResponse early.
+    """
+
+    def __init__(self, resp: requests.Response, chunk_size: int):
+        self._resp = resp
+        self._chunk_size = chunk_size
+
+    def __iter__(self) -> Generator[bytes, None, None]:
+        try:
+            yield from self._resp.iter_content(self._chunk_size)
+        finally:
+            self._resp.close()
+
+    def close(self) -> None:
+        self._resp.close()
+
+
 class PaperlessAPIError(Exception):
     pass
 
 
 class PaperlessAPI:
+    # Large enough for the thread pools fanning out requests on one instance
+    POOL_CONNECTIONS = 32
+    POOL_MAXSIZE = 64
+    # Paperless-ngx defaults to 25 results per page
+    PAGE_SIZE = 100
+    DOCUMENT_CACHE_SIZE = 1024
+    DOCUMENT_CACHE_TTL = 60
+    CUSTOM_FIELDS_CACHE_TTL = 300
+    # Concurrent requests used for per-document mutations
+    MAX_WORKERS = 8
+    # Documents per /api/documents/bulk_edit/ request
+    BULK_EDIT_CHUNK_SIZE = 100
+
     def __init__(self, base_url: str, api_token: str, timeout: int = 10) -> None:
         self.base_url = base_url.rstrip("/")
         self.timeout = timeout
         self.session = requests.Session()
+        # POST isn't retried, a retried note creation could duplicate the note
+        adapter = self._http_adapter(["GET", "PATCH", "DELETE"])
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # bulk_edit only sets or removes field values, so retrying it is safe.
+        # requests picks the adapter with the longest matching prefix.
+        self.session.mount(
+            self._url("/api/documents/bulk_edit/"),
+            self._http_adapter(["GET", "PATCH", "DELETE", "POST"]),
+        )
         if not api_token:
             raise PaperlessAPIError("paperless api_token is required")
         # Paperless-ngx uses `Token <token>` authorization header
         self.session.headers.update({"Authorization": f"Token {api_token}"})
+        # JSON pages compress well; urllib3 decodes br via the brotli dependency
+        self.session.headers["Accept-Encoding"] = "gzip, br"
+        # caches are per instance and thereby per base_url and api_token
+        self._cache_lock = threading.Lock()
+        self._doc_cache = TTLCache(
+            maxsize=self.DOCUMENT_CACHE_SIZE, ttl=self.DOCUMENT_CACHE_TTL
+        )
+        self._cf_cache = TTLCache(maxsize=1, ttl=self.CUSTOM_FIELDS_CACHE_TTL)
+
+    def _http_adapter(self, retry_methods: List[str]) -> HTTPAdapter:
+        """Return a pooled HTTPAdapter retrying `retry_methods` on gateway errors."""
+        retries = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504],
+            allowed_methods=frozenset(retry_methods),
+            raise_on_status=False,
+        )
+        return HTTPAdapter(
+            pool_connections=self.POOL_CONNECTIONS,
+            pool_maxsize=self.POOL_MAXSIZE,
+            max_retries=retries,
+        )
 
     def _url(self, path: str) -> str:
-        return f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+        # base_url is stripped in __init__ and all paths start with a slash
+        if path.startswith("/"):
+            return self.base_url + path
+        return f"{self.base_url}/{path}"
 
     def _get_json(self, path: str, params: dict | None = None) -> dict:
-        return self._request("get", path, params=params or {}).json()
+        return self._request_json("get", path, params=params or {})
+
+    def _request_json(self, method: str, path: str, **kwargs) -> Any:
+        """Send an HTTP request and decode the JSON response with orjson."""
+        return orjson.loads(self._request(method, path, **kwargs).content)
 
     def _get_content(self, path: str) -> bytes:
         return self._request("get", path).content
@@ -111,6 +207,10 @@ class PaperlessAPI:
             url,
             {k: v for k, v in kwargs.items() if k != "json"},
         )
+        if "json" in kwargs:
+            # encode request bodies with orjson instead of requests' stdlib json
+            kwargs["data"] = orjson.dumps(kwargs.pop("json"))
+            kwargs["headers"] = {"Content-Type": "application/json"}
         try:
             resp = self.session.request(method, url, timeout=self.timeout, **kwargs)
             resp.raise_for_status()
@@ -119,12 +219,65 @@ class PaperlessAPI:
             raise PaperlessAPIError(str(exc)) from exc
         return resp
 
-    def _documents(self, page: int = 1) -> dict:
-        """Return a single page dict from /api/documents/ (paginated)."""
-        return self._get_json("/api/documents/", params={"page": page})
+    def _invalidate_document(self, doc_id: int) -> None:
+        with self._cache_lock:
+            self._doc_cache.pop(keys.hashkey(doc_id), None)
+
+    def _documents(
+        self,
+        page: int = 1,
+        page_size: int = PAGE_SIZE,
+        fields: Optional[Tuple[str, ...]] = None,
+    ) -> dict:
+        """Return a single page dict from /api/documents/ (paginated).
+
+        `fields` limits the returned document fields, all fields if None.
+        """
+        params = {"page": page, "page_size": page_size}
+        if fields:
+            params["fields"] = ",".join(fields)
+        return self._get_json("/api/documents/", params=params)
+
+    def _iter_pages(
+        self, fetch_page: Callable[[int], dict], prefetch: int = 4
+    ) -> Generator[dict, None, None]:
+        """Yield all pages of a paginated endpoint in order.
+
+        The page count is known after the first page, so up to `prefetch`
+        following pages are requested concurrently while the caller consumes
+        the current one.
+        """
+        first = fetch_page(1)
+        yield first
+        results = first.get("results", []) if isinstance(first, dict) else []
+        if not results or not first.get("next"):
+            return
+        page_count = math.ceil(first["count"] / len(results))
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            futures: OrderedDict[int, Future] = OrderedDict()
+            next_page = 2
+            while futures or next_page <= page_count:
+                while next_page <= page_count and len(futures) < prefetch:
+                    futures[next_page] = executor.submit(fetch_page, next_page)
+                    next_page += 1
+                _, future = futures.popitem(last=False)
+                payload = future.result()
+                yield payload
+                if not payload.get("next"):
+                    break
+                if not futures and next_page > page_count:
+                    # the last expected page has a next link, documents were
+                    # added while paginating
+                    page_count += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def documents_custom_field_query_iter(
-        self, custom_field_query: object
+        self,
+        custom_field_query: object,
+        page_size: int = PAGE_SIZE,
+        fields: Optional[Tuple[str, ...]] = None,
     ) -> Generator[Document, None, None]:
         """Yield documents matching a `custom_field_query`.
         see https://docs.paperless-ngx.com/api/#filtering-by-custom-fields
@@ -135,99 +288,156 @@ class PaperlessAPI:
             ["<field_name>", "contains", "<substring>"]
         parsed `Document` models.
         """
-        page = 1
-        while True:
+        # encoded once, the query is the same for every page
+        query = orjson.dumps(custom_field_query).decode()
+
+        def fetch_page(page: int) -> dict:
             params = {
                 "page": page,
-                "custom_field_query": json.dumps(custom_field_query),
+                "page_size": page_size,
+                "custom_field_query": query,
             }
-            payload = self._get_json("/api/documents/", params=params)
-            for doc in payload.get("results", []):
-                yield Document.model_validate(doc)
-            if not payload.get("next"):
-                break
-            page += 1
-
-    def documents_iter(self) -> Generator[Document, None, None]:
-        """Yield documents across all pages as `Document` models."""
-        page = 1
-        while True:
-            payload = self._documents(page=page)
-            for doc in payload.get("results", []):
-                yield Document.model_validate(doc)
-            if not payload.get("next"):
-                break
-            page += 1
+            if fields:
+                params["fields"] = ",".join(fields)
+            return self._get_json("/api/documents/", params=params)
+
+        for payload in self._iter_pages(fetch_page):
+            yield from _document_list_adapter.validate_python(
+                payload.get("results", [])
+            )
 
+    def documents_iter(
+        self, page_size: int = PAGE_SIZE, fields: Optional[Tuple[str, ...]] = None
+    ) -> Generator[Document, None, None]:
+        """Yield documents across all pages as `Document` models.
+
+        `fields` limits the returned document fields, all fields if None.
+        """
+        fetch_page = functools.partial(
+            self._documents, page_size=page_size, fields=fields
+        )
+        for payload in self._iter_pages(fetch_page):
+            yield from _document_list_adapter.validate_python(
+                payload.get("results", [])
+            )
+
+    @cachedmethod(
+        operator.attrgetter("_doc_cache"),
+        # views pass the id from the URL as str, key by int to match invalidation
+        key=lambda self, doc_id: keys.hashkey(int(doc_id)),
+        lock=operator.attrgetter("_cache_lock"),
+    )
     def document(self, doc_id: int) -> Document:
-        """Return document metadata from /api/documents/{id}/ as a Document."""
+        """Return document metadata from /api/documents/{id}/ as a Document.
+
+        Documents are cached for DOCUMENT_CACHE_TTL seconds.
+        """
         return Document.model_validate(self._get_json(f"/api/documents/{doc_id}/"))
 
     def document_notes(self, doc_id: int) -> List[Note]:
         """Return list of notes for a document as `Note` models."""
-        return [
-            Note.model_validate(n)
-            for n in self._get_json(f"/api/documents/{doc_id}/notes/")
-        ]
+        return _note_list_adapter.validate_python(
+            self._get_json(f"/api/documents/{doc_id}/notes/")
+        )
 
     def download_document(self, doc_id: int) -> bytes:
         """Return bytes for a document from /api/documents/{id}/download"""
         res = self._get_content(f"/api/documents/{doc_id}/download/")
         return res
 
+    def download_document_stream(
+        self, doc_id: int, chunk_size: int = 64 * 1024
+    ) -> Iterator[bytes]:
+        """Return an iterator over the bytes of a document in `chunk_size` chunks.
+
+        The request is sent immediately, so HTTP errors raise here rather than
+        while iterating. The response is closed once the iterator is exhausted
+        or closed, also if iteration never started.
+        """
+        resp = self._request("get", f"/api/documents/{doc_id}/download/", stream=True)
+        return _ResponseChunks(resp, chunk_size)
+
     # --- Notes and custom fields helpers ---
     def add_note_to_document(self, doc_id: int, note: str) -> Note:
         """Add a note to a document (POST /api/documents/{id}/notes/).
 
-        Returns the created note dict.
+        Returns the created note.
         """
-        notes = self._request(
+        notes = self._request_json(
             "post", f"/api/documents/{doc_id}/notes/", json={"note": note}
-        ).json()
+        )
+        self._invalidate_document(doc_id)
         if not notes:
             return None
-        return Note.model_validate(notes[-1])
+        # The response lists all notes of the document, don't rely on their
+        # order. Note ids increase, so the created note is the newest note
+        # with the posted content.
+        created = [n for n in notes if n.get("note") == note] or notes
+        return Note.model_validate(max(created, key=lambda n: n["id"]))
 
     def delete_note(self, doc_id: int, note_id: int) -> bool:
         """Delete a note from a document"""
         self._request(
             "delete", f"/api/documents/{doc_id}/notes/", params={"id": note_id}
         )
+        self._invalidate_document(doc_id)
         return True
 
-    def custom_fields(self, page: int = 1) -> dict:
+    def delete_notes(self, doc_id: int, note_ids: List[int]) -> bool:
+        """Delete several notes from a document.
+
+        Paperless-ngx has no bulk endpoint for notes, so the DELETEs are sent
+        concurrently.
+        """
+        self._map_concurrently(
+            lambda note_id: self.delete_note(doc_id, note_id), note_ids
+        )
+        return True
+
+    def custom_fields(self, page: int = 1, page_size: int = PAGE_SIZE) -> dict:
         """Return a single page of custom fields from /api/custom-fields/"""
-        return self._get_json("/api/custom_fields/", params={"page": page})
+        params = {"page": page, "page_size": page_size}
+        return self._get_json("/api/custom_fields/", params=params)
 
-    def custom_fields_iter(self) -> Generator[dict, None, None]:
+    def custom_fields_iter(
+        self, page_size: int = PAGE_SIZE
+    ) -> Generator[dict, None, None]:
         """Yield all custom field objects across pages."""
-        page = 1
-        while True:
-            payload = self.custom_fields(page=page)
-            for cf in payload.get(
-                "results", payload if isinstance(payload, list) else []
-            ):
-                yield CustomField.model_validate(cf)
-            if not payload.get("next"):
-                break
-            page += 1
+        fetch_page = functools.partial(self.custom_fields, page_size=page_size)
+        for payload in self._iter_pages(fetch_page):
+            results = (
+                payload if isinstance(payload, list) else payload.get("results", [])
+            )
+            yield from _custom_field_list_adapter.validate_python(results)
+
+    @cachedmethod(
+        operator.attrgetter("_cf_cache"), lock=operator.attrgetter("_cache_lock")
+    )
+    def _custom_fields_by_name(self) -> Dict[str, CustomField]:
+        """Return custom fields keyed by name, cached for CUSTOM_FIELDS_CACHE_TTL."""
+        by_name = {}
+        for cf in self.custom_fields_iter():
+            by_name.setdefault(cf.name, cf)
+        return by_name
 
     def get_custom_field_by_name(self, name: str) -> Optional[CustomField]:
         """Find a custom field by name (returns first match) or None."""
-        for cf in self.custom_fields_iter():
-            if cf.name == name:
-                return cf
-        return None
+        return self._custom_fields_by_name().get(name)
 
     def create_custom_field(self, name: str, data_type: str = "url") -> CustomField:
         """Create a new global custom field (/api/custom_fields/)."""
-        return CustomField.model_validate(
-            self._request(
+        cf = CustomField.model_validate(
+            self._request_json(
                 "post",
                 "/api/custom_fields/",
                 json={"name": name, "data_type": data_type},
-            ).json()
+            )
         )
+        with self._cache_lock:
+            by_name = self._cf_cache.get(keys.hashkey())
+            if by_name is not None:
+                by_name.setdefault(cf.name, cf)
+        return cf
 
     def delete_custom_field(self, custom_field_id: int) -> bool:
         """Delete a custom field by id (/api/custom_fields/{id}/).
@@ -235,33 +445,106 @@ class PaperlessAPI:
         Returns True on success (200/204). Raises PaperlessAPIError on failure.
         """
         self._request("delete", f"/api/custom_fields/{custom_field_id}/")
+        with self._cache_lock:
+            by_name = self._cf_cache.get(keys.hashkey())
+            if by_name is not None:
+                for name, cf in list(by_name.items()):
+                    if cf.id == custom_field_id:
+                        del by_name[name]
         return True
 
     def add_custom_field_to_document(
-        self, doc: Document, custom_field_id: int, value: str
+        self, doc: Document, custom_field_id: int, value: str, refresh: bool = False
     ) -> Document:
-        """Add or update a custom field instance on a document."""
+        """Add or update a custom field instance on a document.
 
-        doc_cf_instances = doc.custom_fields or []
+        Only the single field is written (via bulk_edit), other custom fields
+        of the document are left untouched. With `refresh` the updated document
+        is fetched from Paperless-ngx, otherwise a local copy of `doc` with the
+        new value is returned.
+        """
+        self.bulk_modify_custom_field([doc.id], custom_field_id, value)
+        if refresh:
+            return self.document(doc.id)
+
+        new_inst = CustomFieldInstance(field=custom_field_id, value=value)
+        doc_cf_instances = [
+            new_inst if inst.field == custom_field_id else inst
+            for inst in doc.custom_fields
+        ]
+        if new_inst not in doc_cf_instances:
+            doc_cf_instances.append(new_inst)
+        return doc.model_copy(update={"custom_fields": doc_cf_instances})
+
+    def _map_concurrently(
+        self, fn: Callable, items: List[Any], max_workers: int = MAX_WORKERS
+    ) -> List[Any]:
+        """Call `fn` for each item on a thread pool and return the results in order.
 
-        updated = False
-        for inst in doc_cf_instances:
-            if inst.field == custom_field_id:
-                inst.value = value
-                updated = True
-                break
+        The first exception raised by `fn` is re-raised.
+        """
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(fn, items))
+
+    def bulk_set_custom_field(
+        self,
+        custom_field_id: int,
+        updates: List[Tuple[Document, Any]],
+        max_workers: int = MAX_WORKERS,
+    ) -> None:
+        """Set a custom field to a per-document value on many documents.
+
+        Paperless-ngx' bulk_edit can only assign one value to all documents,
+        so one bulk_edit request per document is sent concurrently instead.
+        """
+        self._map_concurrently(
+            lambda update: self.add_custom_field_to_document(
+                update[0], custom_field_id, update[1]
+            ),
+            updates,
+            max_workers=max_workers,
+        )
 
-        if not updated:
-            doc_cf_instances.append(
-                CustomFieldInstance(field=custom_field_id, value=value)
+    def _bulk_modify_custom_fields(
+        self, doc_ids: List[int], add_custom_fields: dict, remove_custom_fields: list
+    ) -> None:
+        """POST modify_custom_fields to /api/documents/bulk_edit/ in chunks."""
+        for start in range(0, len(doc_ids), self.BULK_EDIT_CHUNK_SIZE):
+            chunk = doc_ids[start : start + self.BULK_EDIT_CHUNK_SIZE]
+            self._request(
+                "post",
+                "/api/documents/bulk_edit/",
+                json={
+                    "documents": chunk,
+                    "method": "modify_custom_fields",
+                    "parameters": {
+                        "add_custom_fields": add_custom_fields,
+                        "remove_custom_fields": remove_custom_fields,
+                    },
+                },
             )
+            for doc_id in chunk:
+                self._invalidate_document(doc_id)
+
+    def bulk_modify_custom_field(
+        self, doc_ids: List[int], custom_field_id: int, value: Any
+    ) -> None:
+        """Set a custom field to the same value on many documents via bulk_edit."""
+        self._bulk_modify_custom_fields(
+            doc_ids,
+            add_custom_fields={str(custom_field_id): value},
+            remove_custom_fields=[],
+        )
 
-        updated_doc = self._request(
-            "patch",
-            f"/api/documents/{doc.id}/",
-            json={"custom_fields": [cf.model_dump() for cf in doc_cf_instances]},
-        ).json()
-        return Document.model_validate(updated_doc)
+    def bulk_delete_custom_field(
+        self, custom_field_id: int, doc_ids: List[int]
+    ) -> None:
+        """Remove a custom field from many documents via bulk_edit."""
+        self._bulk_modify_custom_fields(
+            doc_ids, add_custom_fields={}, remove_custom_fields=[custom_field_id]
+        )
 
     def delete_custom_field_from_document(
         self, doc: Document, custom_field_id: int
@@ -280,9 +563,20 @@ class PaperlessAPI:
             # No change needed
             return doc
 
-        updated_doc = self._request(
+        updated_doc = self._request_json(
             "patch",
             f"/api/documents/{doc.id}/",
             json={"custom_fields": filtered},
-        ).json()
+        )
+        self._invalidate_document(doc.id)
         return Document.model_validate(updated_doc)
+
+
+@functools.lru_cache(maxsize=32)
+def get_paperless_api(base_url: str, api_token: str) -> PaperlessAPI:
+    """Return a PaperlessAPI shared per base URL and API token.
+
+    Sharing the instance shares its HTTP session and its caches between views
+    and background tasks. A changed token simply maps to a new instance.
+    """
+    return PaperlessAPI(base_url, api_token)
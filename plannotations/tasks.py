@@ -12,13 +12,19 @@ from plannotations.auto_linking import (
 from core.settings import (
     PAPERLESS_URL,
 )
-from .paperless_api import PaperlessAPI
+from .paperless_api import PaperlessAPI, get_paperless_api
 from .annotations import PaperlessAnnotator
 from .models import User
 
 logger = logging.getLogger(__name__)
 
 
+def _get_api_for_user(user_id: int) -> PaperlessAPI:
+    """Return the shared PaperlessAPI for a user's current token."""
+    user = User.objects.only("paperless_api_token").get(id=user_id)
+    return get_paperless_api(PAPERLESS_URL, user.paperless_api_token)
+
+
 @task()
 def task_auto_update_links():
     """Start periodic scan loop (not implemented)."""
@@ -29,28 +35,20 @@ def task_auto_update_links():
 def task_trigger_update_links_manually(user_id: int):
     """Background task to trigger a manual scan."""
     logger.info("Syncer: Triggering manual scan")
-    user = User.objects.get(id=user_id)
-    token = user.paperless_api_token
-    update_document_links(PaperlessAPI(PAPERLESS_URL, token), docs_to_skip=None)
+    update_document_links(_get_api_for_user(user_id), docs_to_skip=None)
 
 
 @task()
 def task_delete_document_links_for_user(user_id: int) -> dict:
     """Background task to remove document links."""
-    user = User.objects.get(id=user_id)
-    token = user.paperless_api_token
-
-    ppl = PaperlessAPI(PAPERLESS_URL, token)
+    ppl = _get_api_for_user(user_id)
     delete_all_document_links(ppl)
 
 
 @task()
 def task_delete_annos_for_user(user_id: int) -> dict:
     """Background task to delete all annotations."""
-    user = User.objects.get(id=user_id)
-    token = user.paperless_api_token
-
-    ppl = PaperlessAPI(PAPERLESS_URL, token)
+    ppl = _get_api_for_user(user_id)
     annotator = PaperlessAnnotator(ppl)
     docs = annotator.delete_all_annotations(docs_to_skip=None)
     return {"docs_processed": len(docs)}
@@ -0,0 +1,193 @@
+import base64
+import gzip
+import json
+import math
+from unittest import mock
+
+from django.template import Template
+from django.test import SimpleTestCase
+
+from .annostorage import (
+    AnnoSerializer,
+    PaperlessNotesStorage,
+    _default_anno_serializer,
+    _template_has_page_line,
+)
+from .paperless_api import PaperlessAPI
+
+
+class IterPagesTests(SimpleTestCase):
+    def setUp(self):
+        self.ppl = PaperlessAPI("http://paperless", "token")
+
+    def _fake_endpoint(self, count, page_size, requested, grow_to=None):
+        """Return a fetch_page callable for a paginated endpoint of `count` items.
+
+        With `grow_to` the endpoint grows to that many items once the first
+        page was fetched.
+        """
+        state = {"count": count}
+
+        def fetch_page(page):
+            requested.append(page)
+            if page == 1 and grow_to is not None:
+                result_count = state["count"]
+                state["count"] = grow_to
+            else:
+                result_count = state["count"]
+            pages = math.ceil(state["count"] / page_size)
+            if page > pages:
+                raise AssertionError(f"requested page {page} of {pages}")
+            start = (page - 1) * page_size
+            results = list(range(start, min(start + page_size, state["count"])))
+            return {
+                "count": result_count,
+                "next": "next" if page < pages else None,
+                "results": results,
+            }
+
+        return fetch_page
+
+    def test_requests_only_existing_pages(self):
+        requested = []
+        fetch_page = self._fake_endpoint(23, 5, requested)
+        payloads = list(self.ppl._iter_pages(fetch_page, prefetch=4))
+        self.assertEqual(len(payloads), 5)
+        self.assertEqual(sorted(requested), [1, 2, 3, 4, 5])
+
+    def test_single_page(self):
+        requested = []
+        fetch_page = self._fake_endpoint(3, 5, requested)
+        self.assertEqual(len(list(self.ppl._iter_pages(fetch_page))), 1)
+        self.assertEqual(requested, [1])
+
+    def test_follows_pages_added_while_paginating(self):
+        requested = []
+        fetch_page = self._fake_endpoint(10, 5, requested, grow_to=17)
+        results = [
+            item
+            for payload in self.ppl._iter_pages(fetch_page, prefetch=4)
+            for item in payload["results"]
+        ]
+        self.assertEqual(results, list(range(17)))
+        self.assertEqual(sorted(requested), [1, 2, 3, 4])
+
+
+class DownloadDocumentStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.ppl = PaperlessAPI("http://paperless", "token")
+        self.response = mock.Mock()
+        self.response.iter_content.return_value = iter([b"ab", b"cd"])
+        self.ppl.session.request = mock.Mock(return_value=self.response)
+
+    def test_closes_response_after_iteration(self):
+        chunks = self.ppl.download_document_stream(1)
+        self.assertEqual(b"".join(chunks), b"abcd")
+        self.response.close.assert_called()
+
+    def test_closes_response_when_closed_before_iteration(self):
+        chunks = self.ppl.download_document_stream(1)
+        chunks.close()
+        self.response.close.assert_called_once()
+
+
+class AddNoteToDocumentTests(SimpleTestCase):
+    def setUp(self):
+        self.ppl = PaperlessAPI("http://paperless", "token")
+
+    def _note(self, note_id, text):
+        return {
+            "id": note_id,
+            "note": text,
+            "created": "2024-01-01T00:00:00Z",
+            "user": {"id": 1, "username": "user"},
+        }
+
+    def test_returns_created_note_regardless_of_order(self):
+        notes = [self._note(3, "new"), self._note(2, "old"), self._note(1, "new")]
+        for response in (notes, notes[::-1]):
+            with mock.patch.object(self.ppl, "_request_json", return_value=response):
+                self.assertEqual(self.ppl.add_note_to_document(1, "new").id, 3)
+
+
+class DocumentCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.ppl = PaperlessAPI("http://paperless", "token")
+        self.get_json = mock.Mock(return_value={"id": 5})
+        self.ppl._get_json = self.get_json
+
+    def test_str_and_int_ids_share_an_entry(self):
+        self.ppl.document("5")
+        self.ppl.document(5)
+        self.assertEqual(self.get_json.call_count, 1)
+
+    def test_invalidation_evicts_str_ids(self):
+        self.ppl.document("5")
+        self.ppl._invalidate_document(5)
+        self.ppl.document("5")
+        self.assertEqual(self.get_json.call_count, 2)
+
+
+class Base85SerializerTests(SimpleTestCase):
+    small = {"id": "a"}
+    large = {"id": "a", "contents": "x" * 2000}
+
+    def test_85zj_round_trip(self):
+        serializer = AnnoSerializer.get_serializer_by_name("85zj")
+        for obj in (self.small, self.large):
+            self.assertEqual(serializer.deserialize(serializer.serialize(obj)), obj)
+
+    def test_85gj_writes_gzip(self):
+        serializer = AnnoSerializer.get_serializer_by_name("85gj")
+        for obj in (self.small, self.large):
+            data = base64.b85decode(serializer.serialize(obj))
+            self.assertEqual(json.loads(gzip.decompress(data)), obj)
+            self.assertEqual(serializer.deserialize(serializer.serialize(obj)), obj)
+
+
+class TemplateHasPageLineTests(SimpleTestCase):
+    def _check(self, source):
+        _template_has_page_line.cache_clear()
+        self.addCleanup(_template_has_page_line.cache_clear)
+        with mock.patch(
+            "plannotations.annostorage._get_note_template",
+            return_value=Template(source),
+        ):
+            return _template_has_page_line()
+
+    def test_page_line_first(self):
+        self.assertTrue(self._check("Page: {{page}}\nAuthor: {{author}}\n"))
+
+    def test_user_text_before_page_line(self):
+        self.assertFalse(self._check("Author: {{author}}\nPage: {{page}}\n"))
+        self.assertFalse(self._check("{{comment}}\nPage: {{page}}\n"))
+
+    def test_tag_before_page_line(self):
+        self.assertFalse(self._check("{% if page %}x{% endif %}\nPage: {{page}}\n"))
+
+    def test_no_page_line(self):
+        self.assertFalse(self._check("Author: {{author}}\n"))
+
+
+class RetryPolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.ppl = PaperlessAPI("http://paperless", "token")
+
+    def _retries_post(self, path):
+        adapter = self.ppl.session.get_adapter(self.ppl._url(path))
+        return "POST" in adapter.max_retries.allowed_methods
+
+    def test_bulk_edit_post_is_retried(self):
+        self.assertTrue(self._retries_post("/api/documents/bulk_edit/"))
+
+    def test_note_post_is_not_retried(self):
+        self.assertFalse(self._retries_post("/api/documents/1/notes/"))
+
+
+class DefaultSerializerTests(SimpleTestCase):
+    def test_unknown_serializer_fails_only_for_notes_storage(self):
+        _default_anno_serializer.cache_clear()
+        self.addCleanup(_default_anno_serializer.cache_clear)
+        with mock.patch("plannotations.annostorage.ANNO_SERIALIZER", "nope"):
+            with self.assertRaises(ValueError):
+                PaperlessNotesStorage(PaperlessAPI("http://paperless", "token"))
@@ -1,8 +1,10 @@
 import logging
-from collections import defaultdict
+import threading
+from collections import OrderedDict, defaultdict
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.db import IntegrityError, transaction
 from core.settings import (
     ANNO_STORAGE,
     ENABLE_AUTO_UPDATE_LINKS,
@@ -21,12 +23,19 @@ from .tasks import (
 
 logging = logging.getLogger(__name__)
 
-_last_viewed_docs: defaultdict[int, list[tuple[int, str]]] = defaultdict(
-    list
-)  # user id -> doc ids and titles
+_last_viewed_docs: defaultdict[int, OrderedDict[int, str]] = defaultdict(
+    OrderedDict
+)  # user id -> doc ids and titles, most recent first
+_last_viewed_docs_lock = threading.Lock()
 _keep_last_n_docs = 10  # Keep last N documents per user
 
 
+def _get_last_viewed_docs(uid: int) -> list[tuple[int, str]]:
+    """Return (doc id, title) tuples of the documents a user viewed last."""
+    with _last_viewed_docs_lock:
+        return list(_last_viewed_docs.get(uid, {}).items())
+
+
 def _create_user_from_request(request, is_admin):
     """Helper to create a user from a request POST data."""
     username = request.POST.get("username")
@@ -40,24 +49,30 @@ def _create_user_from_request(request, is_admin):
     if password1 != password2:
         messages.error(request, "Passwords do not match.")
         return None
-    if User.objects.filter(username=username).exists():
+    # Create user, the unique username constraint rejects existing users
+    try:
+        with transaction.atomic():
+            if is_admin:
+                user = User.objects.create_superuser(
+                    username=username,
+                    password=password1,
+                    paperless_api_token=token or None,
+                )
+            else:
+                user = User.objects.create_user(
+                    username=username,
+                    password=password1,
+                    paperless_api_token=token,
+                )
+    except IntegrityError:
+        # only look the user up on failure, other constraint errors propagate
+        if not User.objects.filter(username=username).exists():
+            raise
         messages.error(request, f"User '{username}' already exists.")
         return None
-    # Create user
-    user = None
     if is_admin:
-        user = User.objects.create_superuser(
-            username=username,
-            password=password1,
-            paperless_api_token=token or None,
-        )
         messages.success(request, f"Admin account '{username}' created successfully.")
     else:
-        user = User.objects.create_user(
-            username=username,
-            password=password1,
-            paperless_api_token=token,
-        )
         messages.success(request, f"User '{username}' created successfully.")
     logging.info("Created user: %s, is_admin: %s", username, is_admin)
     return user
@@ -116,11 +131,12 @@ def view_document(request, doc_id: int):
     doc_id = document.id
     uid = request.user.id
 
-    cache_obj = (doc_id, doc_name)
-    if cache_obj in _last_viewed_docs[uid]:
-        _last_viewed_docs[uid].remove(cache_obj)
-    _last_viewed_docs[uid].insert(0, cache_obj)
-    _last_viewed_docs[uid] = _last_viewed_docs[uid][:_keep_last_n_docs]
+    with _last_viewed_docs_lock:
+        mru = _last_viewed_docs[uid]
+        mru[doc_id] = doc_name
+        mru.move_to_end(doc_id, last=False)
+        while len(mru) > _keep_last_n_docs:
+            mru.popitem(last=True)
 
     return render(
         request,
@@ -167,7 +183,7 @@ def index(request):
             "request": request,
             "version": VERSION,
             "infos": infos,
-            "last_viewed_docs": _last_viewed_docs.get(request.user.id, []),
+            "last_viewed_docs": _get_last_viewed_docs(request.user.id),
         },
     )
 